@@ -1,422 +1,543 @@
-import asyncio
-import logging
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
-import requests
-import os
-from dotenv import load_dotenv
-import sqlite3
-from contextlib import contextmanager
-
-# Загружаем переменные окружения из .env
-load_dotenv()
-
-# Получаем токены и URL из .env
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-PLAYWALLET_API_TOKEN = os.getenv("PLAYWALLET_API_TOKEN")
-# Получаем URL из .env, с резервным значением
-PLAYWALLET_BASE_URL = os.getenv("PLAYWALLET_BASE_URL", "https://api.playwallet.bot")
-
-if not TELEGRAM_BOT_TOKEN or not PLAYWALLET_API_TOKEN:
-    raise ValueError("Необходимо указать TELEGRAM_BOT_TOKEN и PLAYWALLET_API_TOKEN в файле .env")
-
-# Инициализация бота и диспетчера
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
-dp = Dispatcher()
-
-# --- РАБОТА С БАЗОЙ ДАННЫХ ---
-
-DATABASE_NAME = "bot_database.db"
-
-# --- Структура таблиц ---
-
-# Таблица пользователей
-CREATE_USERS_TABLE = """
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    telegram_id INTEGER UNIQUE NOT NULL,
-    username TEXT,
-    first_name TEXT,
-    last_name TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    is_admin BOOLEAN DEFAULT 0,
-    steam_wallet_balance REAL DEFAULT 0.0 -- Баланс в "условных" валютах Steam, например, рубли
-);
-"""
-
-# Таблица транзакций
-CREATE_TRANSACTIONS_TABLE = """
-CREATE TABLE IF NOT EXISTS transactions (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_telegram_id INTEGER NOT NULL,
-    type TEXT NOT NULL, -- 'deposit', 'withdrawal', 'steam_purchase', 'bonus' и т.д.
-    amount REAL NOT NULL,
-    currency TEXT NOT NULL, -- 'TON', 'RUB', 'USD' и т.д.
-    status TEXT DEFAULT 'pending', -- 'pending', 'completed', 'failed'
-    external_id TEXT, -- ID транзакции в PlayWallet или Steam
-    description TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_telegram_id) REFERENCES users (telegram_id)
-);
-"""
-
-# --- Вспомогательные функции БД ---
-
-@contextmanager
-def get_db_connection():
-    """Контекстный менеджер для подключения к БД."""
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row # Позволяет обращаться к колонкам по имени
-    try:
-        yield conn
-    except Exception as e:
-        logging.error(f"Ошибка работы с БД: {e}")
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
-
-def init_db():
-    """Инициализирует базу данных и создает таблицы."""
-    with get_db_connection() as conn:
-        conn.execute(CREATE_USERS_TABLE)
-        conn.execute(CREATE_TRANSACTIONS_TABLE)
-        conn.commit()
-        logging.info("База данных инициализирована.")
-
-# --- Функции для работы с пользователями ---
-
-def get_or_create_user(telegram_id: int, username: str = None, first_name: str = None, last_name: str = None):
-    """Получает пользователя из БД или создает нового."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR IGNORE INTO users (telegram_id, username, first_name, last_name) VALUES (?, ?, ?, ?)",
-            (telegram_id, username, first_name, last_name)
-        )
-        cursor.execute(
-            "SELECT * FROM users WHERE telegram_id = ?",
-            (telegram_id,)
-        )
-        user = cursor.fetchone()
-        conn.commit()
-        return user
-
-def get_user_by_telegram_id(telegram_id: int):
-    """Получает пользователя по telegram_id."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM users WHERE telegram_id = ?",
-            (telegram_id,)
-        )
-        return cursor.fetchone()
-
-def set_user_admin_status(telegram_id: int, is_admin: bool):
-    """Устанавливает статус администратора для пользователя."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE users SET is_admin = ? WHERE telegram_id = ?",
-            (1 if is_admin else 0, telegram_id)
-        )
-        conn.commit()
-        logging.info(f"Статус администратора для {telegram_id} изменен на {is_admin}")
-
-def get_all_users():
-    """Получает всех пользователей."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users")
-        return cursor.fetchall()
-
-def update_steam_wallet_balance(telegram_id: int, new_balance: float):
-    """Обновляет баланс Steam кошелька пользователя."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE users SET steam_wallet_balance = ? WHERE telegram_id = ?",
-            (new_balance, telegram_id)
-        )
-        conn.commit()
-        logging.info(f"Баланс Steam кошелька для {telegram_id} обновлен до {new_balance}")
-
-# --- Функции для работы с транзакциями ---
-
-def add_transaction(user_telegram_id: int, type: str, amount: float, currency: str, status: str = 'pending', external_id: str = None, description: str = ""):
-    """Добавляет новую транзакцию."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO transactions (user_telegram_id, type, amount, currency, status, external_id, description) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (user_telegram_id, type, amount, currency, status, external_id, description)
-        )
-        transaction_id = cursor.lastrowid
-        conn.commit()
-        logging.info(f"Добавлена транзакция ID {transaction_id} для пользователя {user_telegram_id}")
-        return transaction_id
-
-def get_transactions_by_user(telegram_id: int, limit: int = 10):
-    """Получает последние N транзакций пользователя."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM transactions WHERE user_telegram_id = ? ORDER BY created_at DESC LIMIT ?",
-            (telegram_id, limit)
-        )
-        return cursor.fetchall()
-
-def get_all_transactions(limit: int = 50):
-    """Получает последние N транзакций от всех пользователей (для админ-панели)."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM transactions ORDER BY created_at DESC LIMIT ?",
-            (limit,)
-        )
-        return cursor.fetchall()
-
-def update_transaction_status(transaction_id: int, new_status: str):
-    """Обновляет статус транзакции."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE transactions SET status = ? WHERE id = ?",
-            (new_status, transaction_id)
-        )
-        conn.commit()
-        logging.info(f"Статус транзакции ID {transaction_id} обновлен на {new_status}")
-
-# --- Функции для статистики (для админ-панели) ---
-
-def get_total_users_count():
-    """Получает общее количество пользователей."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) as count FROM users")
-        return cursor.fetchone()['count']
-
-def get_total_transactions_count():
-    """Получает общее количество транзакций."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) as count FROM transactions")
-        return cursor.fetchone()['count']
-
-def get_total_completed_deposit_amount():
-    """Получает общую сумму завершённых депозитов."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT SUM(amount) as total FROM transactions WHERE type = 'deposit' AND status = 'completed'")
-        result = cursor.fetchone()['total']
-        return result if result is not None else 0.0
-
-def get_total_completed_withdrawal_amount():
-    """Получает общую сумму завершённых выводов."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT SUM(amount) as total FROM transactions WHERE type = 'withdrawal' AND status = 'completed'")
-        result = cursor.fetchone()['total']
-        return result if result is not None else 0.0
-
-def get_recent_transactions(limit: int = 10):
-    """Получает последние N транзакций."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM transactions ORDER BY created_at DESC LIMIT ?", (limit,))
-        return cursor.fetchall()
-
-
-# --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
-
-# Вспомогательная функция для отправки запросов к API PlayWallet
-def call_playwallet_api(method, data=None):
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {PLAYWALLET_API_TOKEN}"
-    }
-    url = f"{PLAYWALLET_BASE_URL}/{method}"
-    logging.info(f"Отправка запроса к {url}")
-
-    # Логируем данные запроса (если есть)
-    if data:
-        logging.info(f"Данные запроса: {data}")
-
-    try:
-        if data:
-            response = requests.post(url, json=data, headers=headers)
-        else:
-            response = requests.get(url, headers=headers)
-
-        # Логируем статус ответа и текст
-        logging.info(f"Статус ответа: {response.status_code}")
-        logging.info(f"Текст ответа: {response.text}")
-
-        response.raise_for_status()  # Возбуждает исключение для кодов ошибок HTTP
-        return response.json()
-
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Ошибка при запросе к PlayWallet API ({url}): {e}")
-        if 'response' in locals():  # Проверяем, существует ли переменная response
-            logging.error(f"Ответ API (текст): {response.text}")
-            logging.error(f"Ответ API (статус): {response.status_code}")
-        return None
-
-# --- АДМИН-ПАНЕЛЬ ---
-
-# Список администраторов (их telegram_id). Заполняется вручную или через команду.
-# Пока что для примера, можно сделать команду /add_admin <id>
-ADMIN_IDS = [1848571732, 741974404] # ЗАМЕНИТЕ НА СВОЙ РЕАЛЬНЫЙ TELEGRAM ID
-
-def is_admin(telegram_id: int) -> bool:
-    """Проверяет, является ли пользователь администратором."""
-    user = get_user_by_telegram_id(telegram_id)
-    return user and (user['is_admin'] or telegram_id in ADMIN_IDS)
-
-async def send_admin_stats(message: types.Message):
-    """Отправляет администратору статистику бота."""
-    if not is_admin(message.from_user.id):
-        await message.answer("У вас нет прав для просмотра статистики.")
-        return
-
-    total_users = get_total_users_count()
-    total_transactions = get_total_transactions_count()
-    total_deposits = get_total_completed_deposit_amount()
-    total_withdrawals = get_total_completed_withdrawal_amount()
-    recent_transactions = get_recent_transactions(limit=5)
-
-    stats_text = (
-        "<b>📊 Статистика бота:</b>\n"
-        f"Всего пользователей: <code>{total_users}</code>\n"
-        f"Всего транзакций: <code>{total_transactions}</code>\n"
-        f"Всего пополнений (завершённых): <code>{total_deposits:.2f}</code>\n"
-        f"Всего выводов (завершённых): <code>{total_withdrawals:.2f}</code>\n\n"
-        "<b>Последние транзакции:</b>\n"
-    )
-    for tx in recent_transactions:
-        stats_text += (
-            f"ID: <code>{tx['id']}</code>, "
-            f"User: <code>{tx['user_telegram_id']}</code>, "
-            f"Тип: <code>{tx['type']}</code>, "
-            f"Сумма: <code>{tx['amount']} {tx['currency']}</code>, "
-            f"Статус: <code>{tx['status']}</code>\n"
-        )
-
-    await message.answer(stats_text, parse_mode="HTML")
-
-
-# --- ОБРАБОТЧИКИ КОМАНД ---
-
-@dp.message(Command("start"))
-async def cmd_start(message: types.Message):
-    # При запуске бота, сохраняем или обновляем информацию о пользователе в БД
-    get_or_create_user(
-        telegram_id=message.from_user.id,
-        username=message.from_user.username,
-        first_name=message.from_user.first_name,
-        last_name=message.from_user.last_name
-    )
-
-    welcome_text = (
-        f"Привет, {message.from_user.full_name}!\n"
-        f"Я бот для пополнения Steam аккаунтов через PlayWallet.\n"
-        f"Ваша ссылка для пополнения: https://t.me/your_bot_username?start={message.from_user.id}\n" # Замените your_bot_username
-        f"Используйте команды /balance, /deposit, /transactions или /help для начала."
-    )
-    await message.answer(welcome_text)
-
-@dp.message(Command("balance"))
-async def cmd_balance(message: types.Message):
-    user = get_user_by_telegram_id(message.from_user.id)
-    if user:
-        # Показываем баланс из нашей БД
-        steam_balance = user['steam_wallet_balance']
-        await message.answer(f"Ваш текущий баланс в боте (Steam кошелёк): <code>{steam_balance:.2f} RUB</code>", parse_mode="HTML")
-    else:
-        await message.answer("Вы не зарегистрированы. Пожалуйста, используйте /start.")
-
-@dp.message(Command("transactions"))
-async def cmd_transactions(message: types.Message):
-    user = get_user_by_telegram_id(message.from_user.id)
-    if user:
-        transactions = get_transactions_by_user(message.from_user.id, limit=5)
-        if transactions:
-            tx_list = "\n".join([
-                f"ID: <code>{tx['id']}</code> | {tx['type'].capitalize()}: <code>{tx['amount']} {tx['currency']}</code> | Статус: <code>{tx['status']}</code>"
-                for tx in transactions
-            ])
-            await message.answer(f"<b>Ваши последние транзакции:</b>\n{tx_list}", parse_mode="HTML")
-        else:
-            await message.answer("У вас пока нет транзакций.")
-    else:
-        await message.answer("Вы не зарегистрированы. Пожалуйста, используйте /start.")
-
-@dp.message(Command("deposit"))
-async def cmd_deposit(message: types.Message):
-    # Пример вызова API для инициации депозита
-    # Требуется указать сумму, криптовалюту и, возможно, адрес возврата
-    # Это упрощённый пример, требует доработки в зависимости от требований API и UX
-    example_amount = 10
-    example_currency = "TON"
-    data_to_send = {
-        "amount": example_amount,
-        "currency": example_currency,
-    }
-    api_response = call_playwallet_api("createDeposit", data=data_to_send)
-    if api_response:
-        # Примерная структура ответа, может отличаться
-        deposit_address = api_response.get('address', 'Неизвестен')
-        deposit_amount = api_response.get('amount', 'Неизвестна')
-        deposit_currency = api_response.get('currency', 'TON')
-        instructions = api_response.get('instructions', 'Отправьте криптовалюту на указанный адрес.')
-
-        response_text = (
-            f"Для пополнения отправьте <b>{deposit_amount} {deposit_currency}</b> на адрес:\n"
-            f"<code>{deposit_address}</code>\n\n"
-            f"{instructions}\n\n"
-            f"<i>После отправки криптовалюты, пожалуйста, сообщите об этом администратору или используйте команду /check_deposit, если она будет реализована.</i>"
-        )
-        # Добавляем транзакцию в БД как 'pending'
-        add_transaction(
-            user_telegram_id=message.from_user.id,
-            type='deposit',
-            amount=deposit_amount,
-            currency=deposit_currency,
-            status='pending',
-            external_id=api_response.get('externalId'), # Если API возвращает ID транзакции
-            description=f"Ожидание пополнения {deposit_amount} {deposit_currency}"
-        )
-        await message.answer(response_text, parse_mode="HTML")
-    else:
-        await message.answer("Не удалось создать депозит. Попробуйте позже.")
-
-@dp.message(Command("help"))
-async def cmd_help(message: types.Message):
-    help_text = (
-        "/start - Приветственное сообщение\n"
-        "/balance - Проверить баланс\n"
-        "/deposit - Получить инструкции по пополнению\n"
-        "/transactions - Посмотреть последние транзакции\n"
-        "/stats - Показать статистику бота (только для администраторов)\n"
-        "/help - Показать это сообщение"
-    )
-    await message.answer(help_text)
-
-# --- Команда для администратора ---
-@dp.message(Command("stats"))
-async def cmd_stats(message: types.Message):
-    await send_admin_stats(message)
-
-
-# --- ТОЧКА ВХОДА ---
-
-async def main():
-    # Инициализируем базу данных при запуске
-    init_db()
-    logging.info("Бот запускается...")
-    # Запуск бота
-    await dp.start_polling(bot)
-
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
-    asyncio.run(main())
\ No newline at end of file
+import asyncio
+import logging
+from aiogram import Bot, Dispatcher, Router, html, types
+from aiogram.client.default import DefaultBotProperties
+from aiogram.filters import Command
+import aiohttp
+import orjson
+import os
+from dotenv import load_dotenv
+import aiosqlite
+from contextlib import asynccontextmanager
+from typing import Final
+
+# Загружаем переменные окружения из .env
+load_dotenv()
+
+# Получаем токены и URL из .env
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+PLAYWALLET_API_TOKEN = os.getenv("PLAYWALLET_API_TOKEN")
+# Получаем URL из .env, с резервным значением
+PLAYWALLET_BASE_URL = os.getenv("PLAYWALLET_BASE_URL", "https://api.playwallet.bot")
+
+if not TELEGRAM_BOT_TOKEN or not PLAYWALLET_API_TOKEN:
+    raise ValueError("Необходимо указать TELEGRAM_BOT_TOKEN и PLAYWALLET_API_TOKEN в файле .env")
+
+# Инициализация бота и диспетчера. parse_mode задаём один раз по умолчанию,
+# чтобы не передавать его в каждый message.answer()
+bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+dp = Dispatcher()
+# Обработчики регистрируем на роутере и подключаем его к диспетчеру
+router = Router()
+dp.include_router(router)
+
+# --- РАБОТА С БАЗОЙ ДАННЫХ ---
+
+DATABASE_NAME = "bot_database.db"
+
+# Денежные суммы храним в целых "минорных" единицах (копейки/центы):
+# целочисленные SUM точны, без накопления ошибок округления REAL.
+# Для существующей БД есть одноразовый скрипт migrate_to_minor_units.py.
+MINOR_UNITS = 100
+
+# Общее соединение с БД. Создаётся один раз в init_db() при запуске,
+# чтобы не открывать/закрывать файл на каждый запрос и не блокировать event loop.
+db = None
+
+# --- Структура таблиц ---
+
+# Таблица пользователей
+CREATE_USERS_TABLE = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER UNIQUE NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_admin BOOLEAN DEFAULT 0,
+    steam_wallet_balance INTEGER DEFAULT 0 -- Баланс Steam кошелька в копейках (см. MINOR_UNITS)
+);
+"""
+
+# Таблица транзакций
+CREATE_TRANSACTIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_telegram_id INTEGER NOT NULL,
+    type TEXT NOT NULL, -- 'deposit', 'withdrawal', 'steam_purchase', 'bonus' и т.д.
+    amount INTEGER NOT NULL, -- Сумма в минорных единицах валюты (см. MINOR_UNITS)
+    currency TEXT NOT NULL, -- 'TON', 'RUB', 'USD' и т.д.
+    status TEXT DEFAULT 'pending', -- 'pending', 'completed', 'failed'
+    external_id TEXT, -- ID транзакции в PlayWallet или Steam
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_telegram_id) REFERENCES users (telegram_id)
+);
+"""
+
+# Индексы под "горячие" запросы: выборка транзакций пользователя по дате
+# и агрегаты по type/status. Без них эти запросы сканируют всю таблицу.
+CREATE_TX_USER_CREATED_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_tx_user_created ON transactions(user_telegram_id, created_at DESC);
+"""
+CREATE_TX_TYPE_STATUS_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_tx_type_status ON transactions(type, status);
+"""
+
+# --- SQL-запросы ---
+
+# Запросы вынесены в константы: передавая один и тот же объект строки,
+# попадаем в кэш подготовленных выражений соединения и не платим за
+# повторный разбор/планирование SQL на каждое сообщение.
+
+SQL_UPSERT_USER = (
+    "INSERT INTO users (telegram_id, username, first_name, last_name) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(telegram_id) DO UPDATE SET username = excluded.username, "
+    "first_name = excluded.first_name, last_name = excluded.last_name "
+    "RETURNING *"
+)
+SQL_GET_USER = "SELECT * FROM users WHERE telegram_id = ?"
+SQL_SET_ADMIN = "UPDATE users SET is_admin = ? WHERE telegram_id = ?"
+SQL_GET_ALL_USERS = "SELECT * FROM users"
+SQL_UPDATE_BALANCE = "UPDATE users SET steam_wallet_balance = ? WHERE telegram_id = ?"
+SQL_ADD_TRANSACTION = (
+    "INSERT INTO transactions (user_telegram_id, type, amount, currency, status, external_id, description) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_GET_USER_TRANSACTIONS = "SELECT * FROM transactions WHERE user_telegram_id = ? ORDER BY created_at DESC LIMIT ?"
+SQL_GET_ALL_TRANSACTIONS = "SELECT * FROM transactions ORDER BY created_at DESC LIMIT ?"
+SQL_UPDATE_TX_STATUS = "UPDATE transactions SET status = ? WHERE id = ?"
+SQL_COUNT_USERS = "SELECT COUNT(*) as count FROM users"
+SQL_COUNT_TRANSACTIONS = "SELECT COUNT(*) as count FROM transactions"
+SQL_SUM_COMPLETED_DEPOSITS = "SELECT COALESCE(SUM(amount), 0) as total FROM transactions WHERE type = 'deposit' AND status = 'completed'"
+SQL_SUM_COMPLETED_WITHDRAWALS = "SELECT COALESCE(SUM(amount), 0) as total FROM transactions WHERE type = 'withdrawal' AND status = 'completed'"
+SQL_RECENT_TRANSACTIONS = "SELECT * FROM transactions ORDER BY created_at DESC LIMIT ?"
+SQL_ADMIN_STATS = (
+    "SELECT (SELECT COUNT(*) FROM users) AS users_count, "
+    "COUNT(*) AS tx_count, "
+    "COALESCE(SUM(CASE WHEN type = 'deposit' AND status = 'completed' THEN amount END), 0) AS deposits, "
+    "COALESCE(SUM(CASE WHEN type = 'withdrawal' AND status = 'completed' THEN amount END), 0) AS withdrawals "
+    "FROM transactions"
+)
+
+# --- Вспомогательные функции БД ---
+
+@asynccontextmanager
+async def get_db_connection():
+    """Контекстный менеджер для работы с общим соединением БД."""
+    try:
+        yield db
+    except Exception as e:
+        logging.error("Ошибка работы с БД: %s", e)
+        await db.rollback()
+        raise
+
+async def init_db():
+    """Открывает общее соединение, инициализирует базу данных и создает таблицы."""
+    global db
+    db = await aiosqlite.connect(DATABASE_NAME, cached_statements=256)
+    db.row_factory = aiosqlite.Row # Позволяет обращаться к колонкам по имени
+    # Настраиваем SQLite один раз на общем соединении: WAL и synchronous=NORMAL
+    # убирают лишние fsync на каждый commit (бот делает много одиночных записей).
+    # Компромисс: при падении ОС может потеряться последняя незакоммиченная транзакция.
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute("PRAGMA cache_size=-64000")
+    await db.execute("PRAGMA mmap_size=268435456")
+    await db.execute("PRAGMA busy_timeout=5000")
+    await db.execute("PRAGMA wal_autocheckpoint=1000") # Ограничиваем размер WAL-файла
+    await db.execute(CREATE_USERS_TABLE)
+    await db.execute(CREATE_TRANSACTIONS_TABLE)
+    await db.execute(CREATE_TX_USER_CREATED_INDEX)
+    await db.execute(CREATE_TX_TYPE_STATUS_INDEX)
+    # Обновляем sqlite_stat1, чтобы планировщик выбирал составные индексы
+    await db.execute("ANALYZE")
+    await db.commit()
+    logging.info("База данных инициализирована.")
+
+async def close_db():
+    """Закрывает общее соединение с БД при остановке бота."""
+    global db
+    if db is not None:
+        await db.close()
+        db = None
+        logging.info("Соединение с БД закрыто.")
+
+# --- Функции для работы с пользователями ---
+
+async def get_or_create_user(telegram_id: int, username: str = None, first_name: str = None, last_name: str = None):
+    """Получает пользователя из БД или создает нового.
+
+    Один upsert с RETURNING вместо INSERT + SELECT: одна подготовка запроса,
+    один поиск по индексу, заодно обновляются устаревшие данные профиля.
+    Требуется SQLite >= 3.35 (идёт в комплекте с современным Python).
+    """
+    async with get_db_connection() as conn:
+        cursor = await conn.execute(
+            SQL_UPSERT_USER,
+            (telegram_id, username, first_name, last_name)
+        )
+        user = await cursor.fetchone()
+        await conn.commit()
+        return user
+
+async def get_user_by_telegram_id(telegram_id: int):
+    """Получает пользователя по telegram_id."""
+    async with get_db_connection() as conn:
+        async with conn.execute(SQL_GET_USER, (telegram_id,)) as cursor:
+            return await cursor.fetchone()
+
+async def set_user_admin_status(telegram_id: int, is_admin: bool):
+    """Устанавливает статус администратора для пользователя."""
+    async with get_db_connection() as conn:
+        await conn.execute(SQL_SET_ADMIN, (1 if is_admin else 0, telegram_id))
+        await conn.commit()
+        # Поддерживаем кэш администраторов в актуальном состоянии
+        if is_admin:
+            ADMIN_CACHE.add(telegram_id)
+        elif telegram_id not in ADMIN_IDS:
+            ADMIN_CACHE.discard(telegram_id)
+        logging.info("Статус администратора для %s изменен на %s", telegram_id, is_admin)
+
+async def get_all_users():
+    """Получает всех пользователей."""
+    async with get_db_connection() as conn:
+        async with conn.execute(SQL_GET_ALL_USERS) as cursor:
+            return await cursor.fetchall()
+
+async def update_steam_wallet_balance(telegram_id: int, new_balance: int):
+    """Обновляет баланс Steam кошелька пользователя (в минорных единицах)."""
+    async with get_db_connection() as conn:
+        await conn.execute(SQL_UPDATE_BALANCE, (new_balance, telegram_id))
+        await conn.commit()
+        logging.info("Баланс Steam кошелька для %s обновлен до %s", telegram_id, new_balance)
+
+# --- Функции для работы с транзакциями ---
+
+async def add_transaction(user_telegram_id: int, type: str, amount: int, currency: str, status: str = 'pending', external_id: str = None, description: str = ""):
+    """Добавляет новую транзакцию. Сумма — в минорных единицах валюты."""
+    async with get_db_connection() as conn:
+        cursor = await conn.execute(
+            SQL_ADD_TRANSACTION,
+            (user_telegram_id, type, amount, currency, status, external_id, description)
+        )
+        transaction_id = cursor.lastrowid
+        await conn.commit()
+        logging.info("Добавлена транзакция ID %s для пользователя %s", transaction_id, user_telegram_id)
+        return transaction_id
+
+async def get_transactions_by_user(telegram_id: int, limit: int = 10):
+    """Получает последние N транзакций пользователя."""
+    async with get_db_connection() as conn:
+        async with conn.execute(SQL_GET_USER_TRANSACTIONS, (telegram_id, limit)) as cursor:
+            return await cursor.fetchall()
+
+async def get_all_transactions(limit: int = 50):
+    """Получает последние N транзакций от всех пользователей (для админ-панели)."""
+    async with get_db_connection() as conn:
+        async with conn.execute(SQL_GET_ALL_TRANSACTIONS, (limit,)) as cursor:
+            return await cursor.fetchall()
+
+async def update_transaction_status(transaction_id: int, new_status: str):
+    """Обновляет статус транзакции."""
+    async with get_db_connection() as conn:
+        await conn.execute(SQL_UPDATE_TX_STATUS, (new_status, transaction_id))
+        await conn.commit()
+        logging.info("Статус транзакции ID %s обновлен на %s", transaction_id, new_status)
+
+# --- Функции для статистики (для админ-панели) ---
+
+async def get_total_users_count():
+    """Получает общее количество пользователей."""
+    async with get_db_connection() as conn:
+        async with conn.execute(SQL_COUNT_USERS) as cursor:
+            row = await cursor.fetchone()
+            return row['count']
+
+async def get_total_transactions_count():
+    """Получает общее количество транзакций."""
+    async with get_db_connection() as conn:
+        async with conn.execute(SQL_COUNT_TRANSACTIONS) as cursor:
+            row = await cursor.fetchone()
+            return row['count']
+
+async def get_total_completed_deposit_amount():
+    """Получает общую сумму завершённых депозитов (в минорных единицах)."""
+    async with get_db_connection() as conn:
+        async with conn.execute(SQL_SUM_COMPLETED_DEPOSITS) as cursor:
+            return (await cursor.fetchone())['total']
+
+async def get_total_completed_withdrawal_amount():
+    """Получает общую сумму завершённых выводов (в минорных единицах)."""
+    async with get_db_connection() as conn:
+        async with conn.execute(SQL_SUM_COMPLETED_WITHDRAWALS) as cursor:
+            return (await cursor.fetchone())['total']
+
+async def get_recent_transactions(limit: int = 10):
+    """Получает последние N транзакций."""
+    async with get_db_connection() as conn:
+        async with conn.execute(SQL_RECENT_TRANSACTIONS, (limit,)) as cursor:
+            return await cursor.fetchall()
+
+async def get_admin_stats(recent_limit: int = 5):
+    """Собирает всю статистику для админ-панели за один проход по БД.
+
+    Четыре агрегата считаются одним запросом (один проход по таблице
+    транзакций вместо четырёх), последние транзакции читаются тем же
+    соединением.
+    """
+    async with get_db_connection() as conn:
+        async with conn.execute(SQL_ADMIN_STATS) as cursor:
+            stats = dict(await cursor.fetchone())
+        async with conn.execute(SQL_RECENT_TRANSACTIONS, (recent_limit,)) as cursor:
+            stats['recent_transactions'] = await cursor.fetchall()
+        return stats
+
+
+# --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
+
+# Общая HTTP-сессия к PlayWallet. Создаётся один раз в main(): keep-alive
+# переиспользует TCP/TLS-соединение, а асинхронные запросы не блокируют
+# event loop на время ожидания ответа.
+http_session = None
+
+async def init_http_session():
+    """Создаёт общую HTTP-сессию для запросов к PlayWallet."""
+    global http_session
+    http_session = aiohttp.ClientSession(headers={
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {PLAYWALLET_API_TOKEN}"
+    })
+
+async def close_http_session():
+    """Закрывает общую HTTP-сессию при остановке бота."""
+    global http_session
+    if http_session is not None:
+        await http_session.close()
+        http_session = None
+
+# Вспомогательная функция для отправки запросов к API PlayWallet
+async def call_playwallet_api(method, data=None):
+    url = f"{PLAYWALLET_BASE_URL}/{method}"
+    logging.info("Отправка запроса к %s", url)
+
+    # Данные запроса логируем только на DEBUG (ленивое %s-форматирование:
+    # строка не собирается, если уровень выключен)
+    if data:
+        logging.debug("Данные запроса: %s", data)
+
+    try:
+        # Сериализуем и разбираем JSON через orjson: он в разы быстрее
+        # стандартного json и работает напрямую с байтами
+        if data:
+            request_cm = http_session.post(url, data=orjson.dumps(data))
+        else:
+            request_cm = http_session.get(url)
+
+        async with request_cm as response:
+            logging.info("Статус ответа: %s", response.status)
+            # Тело ответа читаем в строку только если DEBUG-лог включён;
+            # иначе .json() декодирует сразу из байтов без лишней копии
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Текст ответа: %s", await response.text())
+
+            response.raise_for_status()  # Возбуждает исключение для кодов ошибок HTTP
+            return orjson.loads(await response.read())
+
+    except (aiohttp.ClientError, orjson.JSONDecodeError) as e:
+        logging.error("Ошибка при запросе к PlayWallet API (%s): %s", url, e)
+        return None
+
+# --- АДМИН-ПАНЕЛЬ ---
+
+# Администраторы (их telegram_id). Заполняется вручную или через команду.
+# frozenset: проверка принадлежности за O(1) вместо прохода по списку.
+# Пока что для примера, можно сделать команду /add_admin <id>
+ADMIN_IDS = frozenset({1848571732, 741974404}) # ЗАМЕНИТЕ НА СВОЙ РЕАЛЬНЫЙ TELEGRAM ID
+
+# Кэш администраторов в памяти: проверка прав — O(1) без похода в БД.
+# Заполняется при старте из таблицы users, обновляется в set_user_admin_status.
+ADMIN_CACHE = set(ADMIN_IDS)
+
+async def load_admin_cache():
+    """Загружает администраторов из БД в кэш при запуске."""
+    async with get_db_connection() as conn:
+        async with conn.execute("SELECT telegram_id FROM users WHERE is_admin = 1") as cursor:
+            async for row in cursor:
+                ADMIN_CACHE.add(row['telegram_id'])
+    logging.info("Кэш администраторов загружен: %s", len(ADMIN_CACHE))
+
+def is_admin(telegram_id: int) -> bool:
+    """Проверяет, является ли пользователь администратором."""
+    return telegram_id in ADMIN_CACHE
+
+async def send_admin_stats(message: types.Message):
+    """Отправляет администратору статистику бота."""
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для просмотра статистики.")
+        return
+
+    stats = await get_admin_stats(recent_limit=5)
+    recent_transactions = stats['recent_transactions']
+
+    # Собираем текст списком и склеиваем один раз: линейно по размеру,
+    # без повторного копирования строки на каждой итерации
+    parts = [
+        "<b>📊 Статистика бота:</b>\n"
+        f"Всего пользователей: <code>{stats['users_count']}</code>\n"
+        f"Всего транзакций: <code>{stats['tx_count']}</code>\n"
+        f"Всего пополнений (завершённых): <code>{stats['deposits'] / MINOR_UNITS:.2f}</code>\n"
+        f"Всего выводов (завершённых): <code>{stats['withdrawals'] / MINOR_UNITS:.2f}</code>\n\n"
+        "<b>Последние транзакции:</b>\n"
+    ]
+    parts.extend(
+        f"ID: <code>{tx['id']}</code>, "
+        f"User: <code>{tx['user_telegram_id']}</code>, "
+        f"Тип: <code>{tx['type']}</code>, "
+        f"Сумма: <code>{tx['amount'] / MINOR_UNITS:.2f} {tx['currency']}</code>, "
+        f"Статус: <code>{tx['status']}</code>\n"
+        for tx in recent_transactions
+    )
+
+    await message.answer("".join(parts))
+
+
+# --- ОБРАБОТЧИКИ КОМАНД ---
+
+# Текст /help не меняется между вызовами — собираем один раз при импорте
+HELP_TEXT: Final[str] = (
+    "/start - Приветственное сообщение\n"
+    "/balance - Проверить баланс\n"
+    "/deposit - Получить инструкции по пополнению\n"
+    "/transactions - Посмотреть последние транзакции\n"
+    "/stats - Показать статистику бота (только для администраторов)\n"
+    "/help - Показать это сообщение"
+)
+
+# Шаблон инструкции по пополнению: собирается один раз при импорте,
+# в обработчике остаётся только подстановка значений
+DEPOSIT_INSTRUCTIONS_TMPL = (
+    "Для пополнения отправьте <b>{amount} {currency}</b> на адрес:\n"
+    "<code>{address}</code>\n\n"
+    "{instructions}\n\n"
+    "<i>После отправки криптовалюты, пожалуйста, сообщите об этом администратору "
+    "или используйте команду /check_deposit, если она будет реализована.</i>"
+)
+
+@router.message(Command("start"))
+async def cmd_start(message: types.Message):
+    # При запуске бота, сохраняем или обновляем информацию о пользователе в БД.
+    # Приветствие не зависит от результата записи, поэтому запускаем upsert
+    # фоном и отвечаем сразу: запись перекрывается сетевым запросом к Telegram
+    upsert_task = asyncio.create_task(get_or_create_user(
+        telegram_id=message.from_user.id,
+        username=message.from_user.username,
+        first_name=message.from_user.first_name,
+        last_name=message.from_user.last_name
+    ))
+
+    # Имя пользователя экранируем: с parse_mode=HTML по умолчанию
+    # символы <, >, & в имени сломали бы разбор сообщения в Telegram
+    welcome_text = (
+        f"Привет, {html.quote(message.from_user.full_name)}!\n"
+        f"Я бот для пополнения Steam аккаунтов через PlayWallet.\n"
+        f"Ваша ссылка для пополнения: https://t.me/your_bot_username?start={message.from_user.id}\n" # Замените your_bot_username
+        f"Используйте команды /balance, /deposit, /transactions или /help для начала."
+    )
+    await message.answer(welcome_text)
+    await upsert_task
+
+@router.message(Command("balance"))
+async def cmd_balance(message: types.Message):
+    user = await get_user_by_telegram_id(message.from_user.id)
+    if user:
+        # Показываем баланс из нашей БД
+        steam_balance = user['steam_wallet_balance'] / MINOR_UNITS
+        await message.answer(f"Ваш текущий баланс в боте (Steam кошелёк): <code>{steam_balance:.2f} RUB</code>")
+    else:
+        await message.answer("Вы не зарегистрированы. Пожалуйста, используйте /start.")
+
+@router.message(Command("transactions"))
+async def cmd_transactions(message: types.Message):
+    # Отдельная проверка регистрации не нужна: у незарегистрированного
+    # пользователя запрос просто вернёт пустой список — один SELECT вместо двух
+    transactions = await get_transactions_by_user(message.from_user.id, limit=5)
+    if transactions:
+        tx_list = "\n".join([
+            f"ID: <code>{tx['id']}</code> | {tx['type'].capitalize()}: <code>{tx['amount'] / MINOR_UNITS:.2f} {tx['currency']}</code> | Статус: <code>{tx['status']}</code>"
+            for tx in transactions
+        ])
+        await message.answer(f"<b>Ваши последние транзакции:</b>\n{tx_list}")
+    else:
+        await message.answer("У вас пока нет транзакций. Если вы ещё не зарегистрированы, используйте /start.")
+
+@router.message(Command("deposit"))
+async def cmd_deposit(message: types.Message):
+    # Пример вызова API для инициации депозита
+    # Требуется указать сумму, криптовалюту и, возможно, адрес возврата
+    # Это упрощённый пример, требует доработки в зависимости от требований API и UX
+    example_amount = 10
+    example_currency = "TON"
+    data_to_send = {
+        "amount": example_amount,
+        "currency": example_currency,
+    }
+    api_response = await call_playwallet_api("createDeposit", data=data_to_send)
+    if api_response:
+        # Примерная структура ответа, может отличаться
+        deposit_address = api_response.get('address', 'Неизвестен')
+        deposit_amount = api_response.get('amount', example_amount)
+        deposit_currency = api_response.get('currency', 'TON')
+        instructions = api_response.get('instructions', 'Отправьте криптовалюту на указанный адрес.')
+
+        response_text = DEPOSIT_INSTRUCTIONS_TMPL.format(
+            amount=deposit_amount,
+            currency=deposit_currency,
+            address=deposit_address,
+            instructions=instructions
+        )
+        # Добавляем транзакцию в БД как 'pending'
+        # Сумму в БД пишем в минорных единицах
+        await add_transaction(
+            user_telegram_id=message.from_user.id,
+            type='deposit',
+            amount=round(float(deposit_amount) * MINOR_UNITS),
+            currency=deposit_currency,
+            status='pending',
+            external_id=api_response.get('externalId'), # Если API возвращает ID транзакции
+            description=f"Ожидание пополнения {deposit_amount} {deposit_currency}"
+        )
+        await message.answer(response_text)
+    else:
+        await message.answer("Не удалось создать депозит. Попробуйте позже.")
+
+@router.message(Command("help"))
+async def cmd_help(message: types.Message):
+    await message.answer(HELP_TEXT)
+
+# --- Команда для администратора ---
+@router.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    await send_admin_stats(message)
+
+
+# --- ТОЧКА ВХОДА ---
+
+async def main():
+    # Инициализируем базу данных и HTTP-сессию при запуске
+    await init_db()
+    await load_admin_cache()
+    await init_http_session()
+    # Закрываем соединение с БД и HTTP-сессию при остановке
+    dp.shutdown.register(close_db)
+    dp.shutdown.register(close_http_session)
+    logging.info("Бот запускается...")
+    # Запуск бота. Забираем у Telegram только message-апдейты:
+    # остальные типы мы не обрабатываем, незачем их получать и разбирать
+    await dp.start_polling(bot, allowed_updates=["message"])
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
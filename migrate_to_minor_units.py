@@ -0,0 +1,40 @@
+"""Одноразовая миграция: переводит денежные суммы в целые минорные единицы.
+
+Раньше users.steam_wallet_balance и transactions.amount хранились как REAL
+в рублях. Теперь бот хранит суммы как INTEGER в копейках (см. MINOR_UNITS
+в main.py). Запустите этот скрипт один раз на существующей базе ПЕРЕД
+запуском новой версии бота:
+
+    python migrate_to_minor_units.py
+"""
+import sqlite3
+
+DATABASE_NAME = "bot_database.db"
+MINOR_UNITS = 100
+
+def migrate():
+    conn = sqlite3.connect(DATABASE_NAME)
+    try:
+        # Защита от повторного запуска: помечаем миграцию в user_version
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= 1:
+            print("Миграция уже выполнена, ничего не делаем.")
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "UPDATE users SET steam_wallet_balance = CAST(ROUND(steam_wallet_balance * ?) AS INTEGER)",
+            (MINOR_UNITS,)
+        )
+        conn.execute(
+            "UPDATE transactions SET amount = CAST(ROUND(amount * ?) AS INTEGER)",
+            (MINOR_UNITS,)
+        )
+        conn.execute("PRAGMA user_version = 1")
+        conn.commit()
+        print("Миграция завершена: суммы переведены в минорные единицы.")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()